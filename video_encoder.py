@@ -1,16 +1,28 @@
 import subprocess
+import asyncio
+import json
 import os
+import re
 import sys
 from typing import Optional, Dict, Tuple, List
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
+from collections import OrderedDict
 from pathlib import Path
 import logging
+import logging.handlers
+import multiprocessing
 import shutil
+import queue
+import atexit
+import functools
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 @dataclass
 class VideoInfo:
     """視訊檔案資訊的資料類別"""
     video_stream: str = ""
+    codec: str = ""
     duration: str = ""
     file_size: float = 0.0  # MB
     width: int = 0
@@ -18,6 +30,23 @@ class VideoInfo:
     fps: float = 0.0
     bitrate: str = ""
 
+PIPE_BUFSIZE = 1024 * 1024  # FFmpeg/ffprobe 子程序管線緩衝區大小，減少讀取的系統呼叫次數
+
+# 解析 ffmpeg -i 輸出用的正規表示式，只需掃描一次 stderr
+_RX_STREAM = re.compile(
+    r"Stream #0:\d+(?P<line>[^\n]*?: Video: (?P<codec>\w+)[^\n]*?, (?P<w>\d+)x(?P<h>\d+)"
+    r"(?:[^\n]*?, (?P<br>\d+ kb/s))?(?:[^\n]*?, (?P<fps>[\d.]+) fps)?[^\n]*)"
+)
+_RX_DURATION = re.compile(r"Duration:\s*([\d:.]+)")
+
+# 本工具產生的輸出檔名 (含重名時加上的編號)
+_RX_OUTPUT_STEM = re.compile(r"_(h266|hevc)(_\d+)?$")
+
+# 批次轉檔子程序共用的探測快取寫入鎖，讓「讀取、合併、寫回」不會與其他子程序交錯
+_probe_cache_lock = None
+
+VIDEO_EXTENSIONS = {".mp4", ".mkv", ".mov", ".avi", ".m4v", ".webm", ".ts", ".flv", ".wmv"}
+
 class FFmpegNotFoundError(Exception):
     """FFmpeg 未找到時的自訂例外"""
     pass
@@ -26,15 +55,86 @@ class VVCNotSupportedError(Exception):
     """不支援 H.266/VVC 編碼時的自訂例外"""
     pass
 
+@functools.lru_cache(maxsize=1)
+def _locate_ffmpeg() -> str:
+    """尋找 FFmpeg 執行檔 (結果會被快取，同一程序只搜尋一次)"""
+    # shutil.which 會依 PATH (Windows 另含 PATHEXT) 搜尋，不需啟動 where/which 子程序
+    found = shutil.which("ffmpeg")
+    if found:
+        return found
+
+    # PATH 中找不到時，檢查常見安裝路徑
+    common_paths = [
+        # 添加用戶實際的安裝路徑
+        Path(r"C:\ffmpe\ffmpeg-2024-10-21-git-baa23e40c1-full_build\bin\ffmpeg.exe"),
+        # 保留其他可能的路徑
+        Path(r"C:\ffmpeg\ffmpeg-master-latest-win64-gpl\bin\ffmpeg.exe"),
+        Path(r"C:\ffmpeg\bin\ffmpeg.exe"),
+        Path(r"C:\Program Files\ffmpeg\bin\ffmpeg.exe"),
+        Path(r"C:\Program Files (x86)\ffmpeg\bin\ffmpeg.exe"),
+        Path.cwd() / "ffmpeg.exe",
+        Path("/usr/bin/ffmpeg"),
+        Path("/usr/local/bin/ffmpeg")
+    ]
+    
+    for path in common_paths:
+        if path.exists():
+            return str(path)
+
+    # 如果都找不到，顯示詳細的錯誤訊息
+    error_msg = (
+        "無法找到 FFmpeg，請確認安裝並設定環境變數\n"
+        "目前的環境變數 PATH：\n" + 
+        "\n".join(os.environ.get('PATH', '').split(os.pathsep))
+    )
+    raise FFmpegNotFoundError(error_msg)
+
+@functools.lru_cache(maxsize=None)
+def _probe_version(ffmpeg_path: str) -> str:
+    """取得 FFmpeg 版本資訊的第一行 (結果會被快取)"""
+    result = subprocess.run(
+        [ffmpeg_path, "-version"],
+        capture_output=True,
+        text=True
+    )
+    return result.stdout.split('\n')[0]
+
+@functools.lru_cache(maxsize=None)
+def _probe_encoders(ffmpeg_path: str) -> str:
+    """取得 FFmpeg 支援的編碼器清單 (結果會被快取)"""
+    result = subprocess.run(
+        [ffmpeg_path, "-encoders"],
+        capture_output=True,
+        text=True
+    )
+    return result.stdout
+
 class VideoEncoder:
     """視訊編碼器類別"""
     
     VALID_PRESETS = ["faster", "fast", "medium", "slow", "slower"]
+    PROBE_CACHE_SIZE = 4096  # 探測快取最多保留的項目數
+    PROBE_CACHE_VERSION = 2  # 探測快取格式版本 (v2 加入 codec 欄位)
+    # 依輸出副檔名明確指定封裝格式，省去 FFmpeg 自動判斷
+    OUTPUT_FORMATS = {
+        ".mp4": "mp4",
+        ".m4v": "mp4",
+        ".mov": "mov",
+        ".mkv": "matroska",
+        ".ts": "mpegts",
+    }
+    FASTSTART_SUFFIXES = {".mp4", ".mov", ".m4v"}
+    # 輸出編碼格式的顯示名稱與輸出檔名後綴
+    CODEC_LABELS = {"vvc": "H.266", "hevc": "HEVC"}
+    CODEC_SUFFIXES = {"vvc": "_h266", "hevc": "_hevc"}
     
     def __init__(self, ffmpeg_path: Optional[str] = None):
-        self.ffmpeg_path = ffmpeg_path or self._find_ffmpeg()
+        self.ffmpeg_path = ffmpeg_path or _locate_ffmpeg()
+        self.ffprobe_path = self._ffprobe_from_ffmpeg(self.ffmpeg_path)
+        # 檔名含格式版本；VideoInfo 欄位變動時遞增，舊快取自然失效
+        self._probe_cache = Path(f"logs/probe_cache.v{self.PROBE_CACHE_VERSION}.json")
+        self._probe_cache_data: Optional[OrderedDict] = None
         self._setup_logging()
-        self._verify_vvc_support()
     
     def _setup_logging(self) -> None:
         """設定日誌記錄"""
@@ -43,174 +143,296 @@ class VideoEncoder:
         
         log_file = log_dir / f"video_encoder_{os.getpid()}.log"
         
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.StreamHandler(),
-                logging.FileHandler(log_file, encoding='utf-8')
-            ]
-        )
+        self._log_listener: Optional[logging.handlers.QueueListener] = None
+        self._log_queue_handler: Optional[logging.handlers.QueueHandler] = None
+        
+        # 與 basicConfig 相同，已設定過日誌時不重複加入處理器
+        root = logging.getLogger()
+        if not root.handlers:
+            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+            stream_handler = logging.StreamHandler()
+            # delay=True：實際寫入日誌時才開啟檔案
+            file_handler = logging.FileHandler(log_file, encoding='utf-8', delay=True)
+            for handler in (stream_handler, file_handler):
+                handler.setFormatter(formatter)
+            
+            # 記錄日誌時只需放入佇列，由背景執行緒負責寫入終端機與檔案
+            log_queue = queue.Queue(-1)
+            self._log_queue_handler = logging.handlers.QueueHandler(log_queue)
+            root.addHandler(self._log_queue_handler)
+            root.setLevel(logging.INFO)
+            self._log_listener = logging.handlers.QueueListener(
+                log_queue, stream_handler, file_handler
+            )
+            self._log_listener.start()
+            # 背景執行緒為 daemon，程式結束前需停止它才能寫出佇列中剩餘的日誌
+            atexit.register(self.close)
         self.logger = logging.getLogger(__name__)
 
-    def _find_ffmpeg(self) -> str:
-        """尋找 FFmpeg 執行檔"""
-        try:
-            # Windows 系統使用 where 命令
-            if os.name == 'nt':
-                process = subprocess.run(
-                    ["where", "ffmpeg"],
-                    capture_output=True,
-                    text=True,
-                    check=True
-                )
-                paths = process.stdout.strip().split('\n')
-            # Unix-like 系統使用 which 命令
-            else:
-                process = subprocess.run(
-                    ["which", "ffmpeg"],
-                    capture_output=True,
-                    text=True,
-                    check=True
-                )
-                paths = [process.stdout.strip()]
-
-            for path in paths:
-                path = path.strip()
-                if path and os.path.exists(path):
-                    return path
-
-        except subprocess.CalledProcessError:
-            # 如果 where/which 命令失敗，嘗試搜尋常見路徑
-            pass
-
-        # 檢查常見路徑
-        common_paths = [
-            # 添加用戶實際的安裝路徑
-            Path(r"C:\ffmpe\ffmpeg-2024-10-21-git-baa23e40c1-full_build\bin\ffmpeg.exe"),
-            # 保留其他可能的路徑
-            Path(r"C:\ffmpeg\ffmpeg-master-latest-win64-gpl\bin\ffmpeg.exe"),
-            Path(r"C:\ffmpeg\bin\ffmpeg.exe"),
-            Path(r"C:\Program Files\ffmpeg\bin\ffmpeg.exe"),
-            Path(r"C:\Program Files (x86)\ffmpeg\bin\ffmpeg.exe"),
-            Path.cwd() / "ffmpeg.exe",
-            Path("/usr/bin/ffmpeg"),
-            Path("/usr/local/bin/ffmpeg")
-        ]
-        
-        # 從環境變數 PATH 中的所有目錄尋找 ffmpeg.exe
-        if os.name == 'nt':
-            path_dirs = os.environ.get('PATH', '').split(os.pathsep)
-            for dir_path in path_dirs:
-                try:
-                    ffmpeg_path = Path(dir_path.strip('"')) / "ffmpeg.exe"
-                    if ffmpeg_path.exists():
-                        return str(ffmpeg_path)
-                except Exception:
-                    continue
-        
-        # 檢查常見路徑
-        for path in common_paths:
-            if path.exists():
-                return str(path)
-
-        # 如果都找不到，顯示詳細的錯誤訊息
-        error_msg = (
-            "無法找到 FFmpeg，請確認安裝並設定環境變數\n"
-            "目前的環境變數 PATH：\n" + 
-            "\n".join(os.environ.get('PATH', '').split(os.pathsep))
-        )
-        raise FFmpegNotFoundError(error_msg)
+    def __getstate__(self) -> dict:
+        """批次轉檔時編碼器會傳給子程序；背景日誌執行緒只屬於主程序，探測快取由子程序自行讀取"""
+        state = self.__dict__.copy()
+        state["_log_listener"] = None
+        state["_log_queue_handler"] = None
+        state["_probe_cache_data"] = None
+        return state
+
+    def close(self) -> None:
+        """停止背景日誌執行緒並寫出剩餘日誌，之後的日誌改為直接寫入"""
+        if self._log_listener is None:
+            return
+        self._log_listener.stop()
+        root = logging.getLogger()
+        root.removeHandler(self._log_queue_handler)
+        for handler in self._log_listener.handlers:
+            root.addHandler(handler)
+        self._log_listener = None
+        self._log_queue_handler = None
 
-    def _verify_vvc_support(self) -> None:
-        """驗證 H.266/VVC 支援"""
+    @staticmethod
+    def _ffprobe_from_ffmpeg(ffmpeg_path: str) -> str:
+        """由 FFmpeg 路徑推得同目錄下的 ffprobe 路徑"""
+        path = Path(ffmpeg_path)
+        # 只替換檔名，避免目錄名稱中的 "ffmpeg" 也被替換
+        return str(path.with_name(path.name.replace("ffmpeg", "ffprobe")))
+
+    def ensure_supported(self) -> str:
+        """
+        驗證 H.266/VVC 支援並回傳 FFmpeg 版本資訊
+        
+        建構時不會檢查，轉檔前才呼叫；探測結果已快取，重複呼叫不會再啟動子程序。
+        不支援時拋出 VVCNotSupportedError。
+        """
         has_vvc, version = self.check_ffmpeg_version()
         if not has_vvc:
             raise VVCNotSupportedError(
                 f"此 FFmpeg 版本 ({version}) 不支援 H.266/VVC 編碼"
             )
+        return version
+
+    @property
+    def has_nvenc(self) -> bool:
+        """是否支援 hevc_nvenc (VVC 沒有 NVENC 硬體編碼路徑，GPU 模式改用 HEVC)"""
+        try:
+            return "hevc_nvenc" in _probe_encoders(self.ffmpeg_path)
+        except OSError:
+            return False
+
+    def target_codec(self, gpu: bool) -> str:
+        """回傳實際輸出的編碼格式：GPU 模式且支援 NVENC 時為 hevc，否則為 vvc"""
+        return "hevc" if gpu and self.has_nvenc else "vvc"
 
     def check_ffmpeg_version(self) -> Tuple[bool, str]:
         """檢查 FFmpeg 版本和支援的編碼器"""
         try:
-            version_result = subprocess.run(
-                [self.ffmpeg_path, "-version"],
-                capture_output=True,
-                text=True
-            )
-            version_info = version_result.stdout.split('\n')[0]
+            version_info = _probe_version(self.ffmpeg_path)
+            encoders = _probe_encoders(self.ffmpeg_path)
             
-            encoders_result = subprocess.run(
-                [self.ffmpeg_path, "-encoders"],
-                capture_output=True,
-                text=True
-            )
-            
-            has_vvc = "libvvenc" in encoders_result.stdout
+            has_vvc = "libvvenc" in encoders
             return has_vvc, version_info
         except Exception as e:
             self.logger.error(f"檢查 FFmpeg 版本時發生錯誤: {e}")
             return False, str(e)
 
+    def _read_probe_cache_file(self) -> dict:
+        """讀取磁碟上的探測快取，檔案不存在或損毀時回傳空字典"""
+        try:
+            data = json.loads(self._probe_cache.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {}
+        # 快取檔內容不是物件時視為損毀，重新建立
+        return data if isinstance(data, dict) else {}
+
+    def _load_probe_cache(self) -> OrderedDict:
+        """載入探測快取 (僅在第一次使用時讀取檔案)"""
+        if self._probe_cache_data is None:
+            self._probe_cache_data = OrderedDict(self._read_probe_cache_file())
+        return self._probe_cache_data
+
+    def _save_probe_cache(self) -> None:
+        """以原子寫入方式儲存探測快取，超過上限時移除最久未使用的項目"""
+        cache = self._load_probe_cache()
+        with _probe_cache_lock or contextlib.nullcontext():
+            # 合併其他程序 (例如平行批次轉檔) 在此期間寫入的項目，避免互相覆蓋
+            for key, value in self._read_probe_cache_file().items():
+                if key not in cache:
+                    cache[key] = value
+                    cache.move_to_end(key, last=False)
+            while len(cache) > self.PROBE_CACHE_SIZE:
+                cache.popitem(last=False)
+            
+            tmp = self._probe_cache.with_suffix(f".{os.getpid()}.tmp")
+            try:
+                tmp.write_text(json.dumps(cache, ensure_ascii=False), encoding='utf-8')
+                tmp.replace(self._probe_cache)
+            except OSError as e:
+                self.logger.warning(f"儲存探測快取時發生錯誤: {e}")
+
+    @staticmethod
+    def _format_duration(seconds: float) -> str:
+        """將秒數格式化為 HH:MM:SS.xx"""
+        minutes, secs = divmod(seconds, 60)
+        hours, minutes = divmod(int(minutes), 60)
+        return f"{hours:02d}:{minutes:02d}:{secs:05.2f}"
+
+    def _probe_with_ffprobe(self, video_path: Path, info: VideoInfo) -> bool:
+        """以 ffprobe 的 JSON 輸出填入視訊資訊，回傳是否成功"""
+        result = subprocess.run(
+            [
+                self.ffprobe_path,
+                "-v", "error",
+                "-select_streams", "v:0",
+                "-show_entries",
+                "stream=codec_name,width,height,r_frame_rate,bit_rate:format=duration,bit_rate",
+                "-print_format", "json",
+                str(video_path)
+            ],
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+            bufsize=PIPE_BUFSIZE
+        )
+        data = json.loads(result.stdout or "{}")
+        stream = (data.get("streams") or [{}])[0]
+        fmt = data.get("format", {})
+        
+        info.width = int(stream.get("width", 0))
+        info.height = int(stream.get("height", 0))
+        
+        # r_frame_rate 為 "num/den" 格式，例如 "30000/1001"
+        num, _, den = stream.get("r_frame_rate", "0/1").partition("/")
+        den = float(den or 1)
+        if den:
+            info.fps = round(float(num) / den, 3)
+        
+        # 部分容器 (如 MKV) 沒有視訊流位元率，改用整體位元率
+        bit_rate = stream.get("bit_rate") or fmt.get("bit_rate")
+        if bit_rate:
+            info.bitrate = f"{int(bit_rate) // 1000} kb/s"
+        
+        if "duration" in fmt:
+            info.duration = self._format_duration(float(fmt["duration"]))
+        
+        if stream:
+            info.codec = stream.get("codec_name", "")
+            parts = [f"Video: {info.codec or 'unknown'}"]
+            if info.width and info.height:
+                parts.append(f"{info.width}x{info.height}")
+            if info.bitrate:
+                parts.append(info.bitrate)
+            if info.fps:
+                parts.append(f"{info.fps:g} fps")
+            info.video_stream = ", ".join(parts)
+        
+        return result.returncode == 0
+
+    def _probe_with_ffmpeg(self, video_path: Path, info: VideoInfo) -> bool:
+        """解析 ffmpeg -i 的 stderr 填入視訊資訊 (ffprobe 不存在時使用)"""
+        result = subprocess.run(
+            [self.ffmpeg_path, "-hide_banner", "-i", str(video_path)],
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            bufsize=PIPE_BUFSIZE
+        )
+        stderr = result.stderr
+        
+        match = _RX_STREAM.search(stderr)
+        if match:
+            info.video_stream = match.group("line").strip()
+            info.codec = match.group("codec")
+            info.width = int(match.group("w"))
+            info.height = int(match.group("h"))
+            if match.group("fps"):
+                info.fps = float(match.group("fps"))
+            if match.group("br"):
+                info.bitrate = match.group("br")
+        
+        match = _RX_DURATION.search(stderr)
+        if match:
+            info.duration = match.group(1)
+        
+        return bool(info.video_stream)
+
     def get_video_info(self, video_path: str) -> VideoInfo:
         """獲取視訊檔案資訊"""
         video_path = Path(video_path)
         if not video_path.exists():
             raise FileNotFoundError(f"找不到視訊檔案: {video_path}")
 
+        # 以 (絕對路徑, 修改時間, 檔案大小) 作為快取鍵，檔案未變動時不需重新探測
+        st = video_path.stat()
+        cache_key = f"{video_path.resolve()}:{st.st_mtime_ns}:{st.st_size}"
+        cache = self._load_probe_cache()
+        if cache_key in cache:
+            try:
+                cached_info = VideoInfo(**cache[cache_key])
+            except TypeError:
+                # 項目格式不符 (欄位不同或不是物件)，移除後重新探測
+                del cache[cache_key]
+            else:
+                cache.move_to_end(cache_key)
+                return cached_info
+
         info = VideoInfo()
-        info.file_size = video_path.stat().st_size / (1024 * 1024)  # Convert to MB
+        info.file_size = st.st_size / (1024 * 1024)  # Convert to MB
 
         try:
-            result = subprocess.run(
-                [self.ffmpeg_path, "-i", str(video_path)],
-                capture_output=True,
-                text=True,
-                encoding='utf-8'
-            )
-            
-            stderr = result.stderr
+            try:
+                probed = self._probe_with_ffprobe(video_path, info)
+            except OSError:
+                # 找不到 ffprobe 時，改為解析 ffmpeg -i 的輸出
+                probed = self._probe_with_ffmpeg(video_path, info)
             
-            # 解析視訊流資訊
-            if "Stream #0:0" in stderr:
-                video_stream = stderr.split("Stream #0:0")[1].split("\n")[0]
-                info.video_stream = video_stream.strip()
-                
-                # 解析解析度
-                if "x" in video_stream:
-                    for part in video_stream.split(","):
-                        if "x" in part:
-                            try:
-                                width, height = map(int, part.strip().split("x"))
-                                info.width = width
-                                info.height = height
-                            except ValueError:
-                                pass
-                
-                # 解析 FPS
-                if "fps" in video_stream.lower():
-                    try:
-                        fps_str = video_stream.split("fps")[0].split(",")[-1].strip()
-                        info.fps = float(fps_str)
-                    except ValueError:
-                        pass
-                
-                # 解析位元率
-                if "kb/s" in video_stream:
-                    for part in video_stream.split(","):
-                        if "kb/s" in part:
-                            info.bitrate = part.strip()
-                
-            # 解析時長
-            if "Duration:" in stderr:
-                duration = stderr.split("Duration:")[1].split(",")[0].strip()
-                info.duration = duration
+            if probed:
+                cache[cache_key] = asdict(info)
+                self._save_probe_cache()
                 
         except Exception as e:
             self.logger.error(f"獲取視訊資訊時發生錯誤: {e}")
             
         return info
 
+    def _build_cmd_cpu(
+        self,
+        input_path: Path,
+        qp: int,
+        threads: int,
+        preset: str
+    ) -> List[str]:
+        """建立使用 libvvenc 軟體編碼的命令"""
+        command = [
+            self.ffmpeg_path,
+            "-fflags", "+genpts",
+            "-i", str(input_path),
+            "-c:v", "libvvenc",
+            "-qp", str(qp),
+            "-preset", preset,
+            "-threads", str(threads)
+        ]
+        # threads 為 0 時交由編碼器自動決定，並允許同時使用幀與切片層級的平行化
+        if threads == 0:
+            command.extend(["-thread_type", "frame+slice"])
+        return command
+
+    def _build_cmd_gpu(self, input_path: Path, qp: int) -> List[str]:
+        """建立使用 NVDEC 解碼與 hevc_nvenc 硬體編碼的命令"""
+        # 硬體加速選項必須在輸入檔案之前
+        return [
+            self.ffmpeg_path,
+            "-hwaccel", "cuda",
+            "-hwaccel_output_format", "cuda",
+            "-fflags", "+genpts",
+            "-i", str(input_path),
+            "-c:v", "hevc_nvenc",
+            "-preset", "p4",
+            "-tune", "hq",
+            "-rc", "vbr",
+            "-cq", str(qp),
+            "-b:v", "0"
+        ]
+
     def encode_to_h266(
         self,
         input_path: str,
@@ -218,7 +440,9 @@ class VideoEncoder:
         qp: int = 32,
         threads: int = 4,
         preset: str = "medium",
-        gpu: bool = False
+        gpu: bool = False,
+        show_progress: bool = True,
+        force: bool = False
     ) -> bool:
         """
         使用 H.266/VVC 編碼器轉檔
@@ -227,10 +451,14 @@ class VideoEncoder:
             input_path: 輸入檔案路徑
             output_path: 輸出檔案路徑
             qp: 量化參數 (20-50)
-            threads: 執行緒數量
+            threads: 執行緒數量 (0 為自動選擇)
             preset: 編碼預設值 ("faster", "fast", "medium", "slow", "slower")
-            gpu: 是否使用 GPU 加速 (需要支援的顯示卡)
+            gpu: 是否使用 GPU 加速 (需要支援 NVENC 的顯示卡，改以 HEVC 編碼)
+            show_progress: 是否即時顯示 FFmpeg 輸出 (批次轉檔時關閉)
+            force: 輸入檔案已是目標編碼格式時仍重新編碼 (預設直接複製串流)
         """
+        self.ensure_supported()
+        
         input_path = Path(input_path)
         if not input_path.exists():
             raise FileNotFoundError(f"找不到輸入檔案: {input_path}")
@@ -238,86 +466,230 @@ class VideoEncoder:
         if preset not in self.VALID_PRESETS:
             raise ValueError(f"無效的預設值: {preset}。有效值為: {', '.join(self.VALID_PRESETS)}")
         
-        command = []
+        if gpu and not self.has_nvenc:
+            self.logger.warning("找不到 hevc_nvenc 編碼器，改用 CPU (libvvenc) 編碼")
+            gpu = False
         
-        # GPU 加速選項必須在輸入檔案之前
-        if gpu:
-            command.extend([
+        # 輸入已是目標編碼格式時重新編碼幾乎沒有效益，改為只複製串流
+        target_codec = self.target_codec(gpu)
+        remux = not force and self.get_video_info(str(input_path)).codec == target_codec
+        if remux:
+            self.logger.info(f"輸入檔案已是 {target_codec} 編碼，直接複製串流")
+            command = [
                 self.ffmpeg_path,
-                "-hwaccel", "auto",
-                "-i", str(input_path)
-            ])
+                "-i", str(input_path),
+                "-c", "copy"
+            ]
         else:
+            if gpu:
+                command = self._build_cmd_gpu(input_path, qp)
+            else:
+                command = self._build_cmd_cpu(input_path, qp, threads, preset)
+            
             command.extend([
-                self.ffmpeg_path,
-                "-i", str(input_path)
+                "-c:a", "aac",
+                "-b:a", "128k",
+                "-avoid_negative_ts", "make_zero"
             ])
         
-        command.extend([
-            "-c:v", "libvvenc",
-            "-qp", str(qp),
-            "-preset", preset,
-            "-threads", str(threads),
-            "-c:a", "aac",
-            "-b:a", "128k"
-        ])
-        
         # 如果輸出路徑已存在，在檔名後加上編號
         output_path = Path(output_path)
         if output_path.exists():
+            # 一次讀取目錄內容，在記憶體中尋找可用編號，避免逐一 stat
+            existing = {entry.name for entry in os.scandir(output_path.parent)}
+            stem, suffix = output_path.stem, output_path.suffix
             index = 1
-            while True:
-                new_path = output_path.parent / f"{output_path.stem}_{index}{output_path.suffix}"
-                if not new_path.exists():
-                    output_path = new_path
-                    break
+            while f"{stem}_{index}{suffix}" in existing:
                 index += 1
+            output_path = output_path.parent / f"{stem}_{index}{suffix}"
+        
+        suffix = output_path.suffix.lower()
+        # moov atom 寫在檔案開頭，串流播放與轉檔後的探測不需搜尋至檔尾
+        if suffix in self.FASTSTART_SUFFIXES:
+            command.extend(["-movflags", "+faststart"])
+        if suffix in self.OUTPUT_FORMATS:
+            command.extend(["-f", self.OUTPUT_FORMATS[suffix]])
+        
+        # 以機器可讀的 key=value 格式將進度寫到 stdout，取代解析 stderr 的統計文字
+        command.extend([
+            "-hide_banner",
+            "-loglevel", "error",
+            "-nostats",
+            "-progress", "pipe:1"
+        ])
         
         command.append(str(output_path))
         
         self.logger.info(f"執行命令: {' '.join(command)}")
         
+        if self._run_encode(command, show_progress):
+            if remux:
+                self.logger.info(f"已複製 {self.CODEC_LABELS[target_codec]} 串流 (未重新編碼): {output_path}")
+            else:
+                self.logger.info(f"成功轉檔為 {self.CODEC_LABELS[target_codec]} 格式: {output_path}")
+            return True
+        self.logger.error("轉檔失敗!")
+        return False
+
+    def _run_encode(self, command: List[str], show_progress: bool = True) -> bool:
+        """執行 FFmpeg 命令並顯示進度，回傳是否成功"""
         try:
-            process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            
-            while True:
-                line = process.stderr.readline()
-                if not line:
-                    break
-                try:
-                    # 嘗試使用不同編碼解碼輸出
-                    for encoding in ['utf-8', 'cp950', 'big5']:
-                        try:
-                            decoded_line = line.decode(encoding)
-                            print(decoded_line, end='')
-                            break
-                        except UnicodeDecodeError:
-                            continue
-                except Exception:
-                    # 如果所有編碼都失敗，跳過此行
-                    continue
-            
-            process.communicate()
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return asyncio.run(self._run_encode_async(command, show_progress))
             
-            if process.returncode == 0:
-                self.logger.info(f"成功轉檔為 H.266 格式: {output_path}")
-                return True
-            else:
-                self.logger.error("轉檔失敗!")
-                return False
-                
+            # 呼叫端已有執行中的事件迴圈 (如 Jupyter)，改在獨立執行緒中建立新的迴圈
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                return pool.submit(
+                    lambda: asyncio.run(self._run_encode_async(command, show_progress))
+                ).result()
         except Exception as e:
             self.logger.error(f"編碼過程發生錯誤: {e}")
             return False
 
+    async def _run_encode_async(self, command: List[str], show_progress: bool) -> bool:
+        """以非阻塞方式讀取 FFmpeg 進度，避免終端機輸出緩慢時管線塞滿而拖慢編碼"""
+        # 錯誤訊息直接輸出到終端機，Python 只讀取 stdout 上的進度資料
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            limit=PIPE_BUFSIZE
+        )
+        
+        # 只保留最新一筆進度，顯示跟不上時捨棄舊資料，讀取管線不需等待終端機
+        progress_queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        display = None
+        if show_progress:
+            display = asyncio.create_task(self._display_progress(progress_queue))
+        
+        # -progress 輸出固定格式的 key=value 行，每個區塊以 progress=continue/end 結尾
+        stats: Dict[str, str] = {}
+        try:
+            async for raw in process.stdout:
+                key, _, value = raw.decode('ascii', 'replace').partition('=')
+                stats[key] = value.strip()
+                if key == "progress" and display is not None and not display.done():
+                    if progress_queue.full():
+                        progress_queue.get_nowait()
+                    progress_queue.put_nowait(dict(stats))
+        finally:
+            # 顯示進度的錯誤不可影響轉檔結果，也不可讓等待結束訊號的流程卡住
+            if display is not None:
+                if not display.done():
+                    if progress_queue.full():
+                        progress_queue.get_nowait()
+                    progress_queue.put_nowait(None)
+                await asyncio.gather(display, return_exceptions=True)
+        
+        await process.wait()
+        return process.returncode == 0
+
+    async def _display_progress(self, progress_queue: asyncio.Queue) -> None:
+        """從佇列取出進度並在執行緒池中輸出，避免阻塞事件迴圈"""
+        loop = asyncio.get_running_loop()
+        while True:
+            stats = await progress_queue.get()
+            if stats is None:
+                break
+            try:
+                await loop.run_in_executor(None, self._print_progress, stats)
+            except Exception as e:
+                # 例如 stdout 已關閉 (BrokenPipeError) 或終端機編碼不支援中文
+                self.logger.warning(f"無法顯示轉檔進度，停止顯示: {e}")
+                break
+
+    @staticmethod
+    def _print_progress(stats: Dict[str, str]) -> None:
+        """在同一行顯示轉檔進度"""
+        out_time = stats.get("out_time", "").split(".")[0]
+        sys.stdout.write(
+            f"\r進度: {out_time}  幀數: {stats.get('frame', '')}  "
+            f"fps: {stats.get('fps', '')}  速度: {stats.get('speed', '')}  "
+        )
+        if stats.get("progress") == "end":
+            sys.stdout.write("\n")
+        sys.stdout.flush()
+
+    def encode_batch(self, jobs: List[dict], concurrency: int) -> Dict[str, bool]:
+        """
+        以多個程序平行轉檔多個檔案
+        
+        參數:
+            jobs: 每個元素為 encode_to_h266 的關鍵字參數 (至少包含 input_path 與 output_path)
+            concurrency: 同時執行的轉檔數量
+        
+        回傳:
+            以輸入檔案路徑為鍵、是否成功為值的字典
+        """
+        # 在分派工作前先驗證，避免每個子程序各自失敗
+        self.ensure_supported()
+        
+        concurrency = max(1, concurrency)
+        cpu_cores = os.cpu_count() or 4
+        # 每個 FFmpeg 子程序仍使用多執行緒，而非一個工作一個執行緒
+        threads_per_job = max(2, cpu_cores // concurrency)
+        
+        # 子程序的日誌經由佇列交給主程序寫入，避免同時寫入同一個日誌檔
+        log_queue = multiprocessing.Queue(-1)
+        listener = logging.handlers.QueueListener(
+            log_queue, *logging.getLogger().handlers, respect_handler_level=True
+        )
+        listener.start()
+        
+        results: Dict[str, bool] = {}
+        try:
+            with ProcessPoolExecutor(
+                max_workers=concurrency,
+                initializer=_init_batch_worker,
+                initargs=(log_queue, multiprocessing.Lock())
+            ) as executor:
+                futures = {}
+                for job in jobs:
+                    job = {"threads": threads_per_job, **job}
+                    future = executor.submit(_run_batch_job, self, job)
+                    futures[future] = str(job["input_path"])
+                
+                for done, future in enumerate(as_completed(futures), 1):
+                    input_path = futures[future]
+                    try:
+                        success = future.result()
+                    except Exception as e:
+                        self.logger.error(f"批次轉檔 {input_path} 時發生錯誤: {e}")
+                        success = False
+                    results[input_path] = success
+                    self.logger.info(
+                        f"批次進度 {done}/{len(futures)}: {input_path} "
+                        f"{'成功' if success else '失敗'}"
+                    )
+        finally:
+            listener.stop()
+            log_queue.close()
+        
+        return results
+
+def _is_previous_output(path: Path, names: set) -> bool:
+    """判斷檔案是否為本工具先前的輸出：檔名符合輸出格式，且對應的原始檔也在同一資料夾"""
+    match = _RX_OUTPUT_STEM.search(path.stem)
+    return match is not None and f"{path.stem[:match.start()]}{path.suffix}" in names
+
+def _init_batch_worker(log_queue, cache_lock) -> None:
+    """批次轉檔子程序初始化：將日誌轉送至主程序，並共用探測快取的寫入鎖"""
+    global _probe_cache_lock
+    _probe_cache_lock = cache_lock
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+
+def _run_batch_job(encoder: VideoEncoder, job: dict) -> bool:
+    """批次轉檔子程序的工作函式"""
+    return encoder.encode_to_h266(**job, show_progress=False)
+
 def main():
     """主程式"""
     print("=== H.266/VVC 視訊轉檔工具 ===\n")
     
+    encoder = None
     try:
         # 檢查 CPU 核心數，設定預設執行緒數
         cpu_cores = os.cpu_count() or 4
@@ -326,20 +698,37 @@ def main():
         encoder = VideoEncoder()
         print(f"找到 FFmpeg: {encoder.ffmpeg_path}")
         
-        _, version_info = encoder.check_ffmpeg_version()
+        # 互動模式在詢問參數前就先驗證，不支援時可立即提示
+        version_info = encoder.ensure_supported()
         print(f"\nFFmpeg 版本: {version_info}")
 
         # 輸入視訊路徑
         while True:
-            input_video = input("\n請輸入要轉檔的視訊路徑: ").strip('"').strip("'")
+            input_video = input("\n請輸入要轉檔的視訊路徑 (或資料夾以批次轉檔): ").strip('"').strip("'")
             input_path = Path(input_video)
             
             if input_path.exists():
                 break
             print(f"錯誤: 找不到檔案 {input_video}")
         
-        # 設定輸出檔案路徑
-        output_path = input_path.parent / f"{input_path.stem}_h266{input_path.suffix}"
+        # 輸入資料夾時，批次轉檔其中所有視訊檔案
+        batch_inputs = []
+        if input_path.is_dir():
+            videos = sorted(
+                p for p in input_path.iterdir()
+                if p.suffix.lower() in VIDEO_EXTENSIONS
+            )
+            names = {p.name for p in videos}
+            skipped = [p for p in videos if _is_previous_output(p, names)]
+            batch_inputs = [p for p in videos if p not in skipped]
+            if not batch_inputs:
+                print(f"錯誤: 資料夾 {input_video} 中沒有視訊檔案")
+                return False
+            print(f"找到 {len(batch_inputs)} 個視訊檔案")
+            if skipped:
+                print(f"略過 {len(skipped)} 個先前的轉檔輸出:")
+                for p in skipped:
+                    print(f"  {p.name}")
         
         # 設定編碼品質
         while True:
@@ -369,15 +758,28 @@ def main():
             except ValueError:
                 print("請輸入有效的數字！")
         
-        # 設定執行緒數
-        while True:
-            try:
-                threads = int(input(f"\n請輸入執行緒數量 (1-{cpu_cores}，建議 {default_threads}): ").strip())
-                if 1 <= threads <= cpu_cores:
-                    break
-                print(f"請輸入 1 到 {cpu_cores} 之間的數值！")
-            except ValueError:
-                print("請輸入有效的數字！")
+        # 設定執行緒數 (批次模式改為設定同時轉檔數量)
+        if batch_inputs:
+            max_concurrency = min(len(batch_inputs), max(1, cpu_cores // 2))
+            while True:
+                try:
+                    concurrency = int(input(f"\n請輸入同時轉檔數量 (1-{max_concurrency}): ").strip())
+                    if 1 <= concurrency <= max_concurrency:
+                        break
+                    print(f"請輸入 1 到 {max_concurrency} 之間的數值！")
+                except ValueError:
+                    print("請輸入有效的數字！")
+        else:
+            print("\n執行緒數量:")
+            print("0. 自動 (建議)")
+            while True:
+                try:
+                    threads = int(input(f"請輸入執行緒數量 (0 為自動，或 1-{cpu_cores}，手動建議 {default_threads}): ").strip())
+                    if 0 <= threads <= cpu_cores:
+                        break
+                    print(f"請輸入 0 到 {cpu_cores} 之間的數值！")
+                except ValueError:
+                    print("請輸入有效的數字！")
         
         # 詢問是否使用 GPU 加速
         try:
@@ -385,6 +787,32 @@ def main():
         except Exception:
             use_gpu = False
         
+        # 依實際使用的編碼格式決定輸出檔名後綴
+        target_codec = encoder.target_codec(use_gpu)
+        codec_label = encoder.CODEC_LABELS[target_codec]
+        name_suffix = encoder.CODEC_SUFFIXES[target_codec]
+        output_path = input_path.parent / f"{input_path.stem}{name_suffix}{input_path.suffix}"
+        
+        if batch_inputs:
+            jobs = [
+                {
+                    "input_path": str(p),
+                    "output_path": str(p.parent / f"{p.stem}{name_suffix}{p.suffix}"),
+                    "qp": qp,
+                    "preset": preset,
+                    "gpu": use_gpu
+                }
+                for p in batch_inputs
+            ]
+            print(f"\n開始批次轉檔 {len(jobs)} 個檔案 (同時 {concurrency} 個)...")
+            results = encoder.encode_batch(jobs, concurrency)
+            succeeded = sum(results.values())
+            print(f"\n批次轉檔完成: 成功 {succeeded} 個，失敗 {len(results) - succeeded} 個")
+            for path, ok in results.items():
+                if not ok:
+                    print(f"失敗: {path}")
+            return succeeded == len(results)
+        
         # 顯示視訊資訊
         print("\n正在分析視訊資訊...")
         info = encoder.get_video_info(input_video)
@@ -402,17 +830,23 @@ def main():
                 print(f"位元率: {info.bitrate}")
             print(f"檔案大小: {info.file_size:.1f} MB")
         
+        # 輸入已是目標編碼格式時，預設只複製串流，由使用者決定是否仍要重新編碼
+        force = False
+        if info.codec == target_codec:
+            print(f"\n此檔案已是 {target_codec} 編碼，預設將直接複製串流而不重新編碼。")
+            force = input("是否仍要重新編碼? (y/N): ").strip().lower() == 'y'
+        
         # 顯示轉檔設定
         print("\n轉檔設定:")
         print(f"編碼品質 (QP): {qp}")
         print(f"預設值: {preset}")
-        print(f"執行緒數: {threads}")
+        print(f"執行緒數: {threads if threads else '自動'}")
         print(f"GPU 加速: {'是' if use_gpu else '否'}")
         
         # 確認開始轉檔
         if input("\n確認開始轉檔? (Y/n): ").strip().lower() not in ['n', 'no']:
             # 開始轉檔
-            print("\n開始轉檔為 H.266 格式...")
+            print(f"\n開始轉檔為 {codec_label} 格式...")
             print("(轉檔過程中會顯示進度，請稍候...)")
             
             success = encoder.encode_to_h266(
@@ -421,7 +855,8 @@ def main():
                 qp=qp,
                 threads=threads,
                 preset=preset,
-                gpu=use_gpu
+                gpu=use_gpu,
+                force=force
             )
             
             if success:
@@ -464,6 +899,11 @@ def main():
         print(f"\n錯誤: {e}")
         print("請確保安裝了支援 libvvenc 的 FFmpeg 版本。")
         return False
+    
+    finally:
+        # 寫出背景日誌執行緒中尚未寫入的日誌
+        if encoder is not None:
+            encoder.close()
 
 if __name__ == "__main__":
     try: